@@ -126,7 +126,7 @@ if __name__ == '__main__':
     
     wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
     
-    spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'zetaCas, x [m(V) = x]', save = False, path = savefold, name = "zetaCas_spectrum_lines.png")
 
@@ -136,11 +136,14 @@ if __name__ == '__main__':
     PlotData(axs[0], dark_av, 'zetaCas', 'dark')
     #PlotData(axs[0], flat_av, 'Alkaid, x [m(V) = x]', 'flat')
     PlotData(axs[1], sum_spectra, None, 'zetaCas processed data')
+    axs[0].legend()
+    axs[1].legend()
     plt.tight_layout()
     plt.savefig(savefold+'/zetaCas.png', dpi = 600)
 
     fig, axs = plt.subplots(1, 1, figsize=(12, 8))
     PlotData(axs, sum_spectra, 'zetaCas, x [m(V) = x]', 'zetaCas processed data')
+    axs.legend()
     plt.savefig(savefold+'/zetaCas_spectrum.png', dpi = 600)
     plt.show()
     '''
@@ -152,6 +155,7 @@ if __name__ == '__main__':
     spectra = LoadAllSpectra(path, 'Castor_data_HDX017711')
     fig, axs = plt.subplots(1, 1, figsize=(12, 8))
     PlotData(axs, spectra[0], 'Castor', 'Castor')
+    axs.legend()
     #plt.savefig(f'/media/astronomer/Transcend/PhD/oceanview/Spectra_stars/Castor_spectrum.png', dpi = 600)
     plt.show()
     '''
@@ -187,6 +191,7 @@ if __name__ == '__main__':
 
     fig, axs = plt.subplots(1, 1, figsize=(12, 8))
     PlotData(axs, flat_av, 'Flat', 'Alkaid Flat')
+    axs.legend()
 
     background_subtr = ProcessDataEach(background, None, dark_av, None, subtract_background = False, subtract_dark = True, divide_flat = False)
     background_subtr_av = AverageSpectra(background_subtr)
@@ -200,7 +205,7 @@ if __name__ == '__main__':
 
     wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Alkaid, x [m(V) = x]', save = False, path = savefold, name = "Alkaid_spectrum_lines.png")
 
@@ -210,6 +215,8 @@ if __name__ == '__main__':
     PlotData(axs[0], dark_av, 'Alkaid', 'dark')
     PlotData(axs[0], flat_av, 'Alkaid, x [m(V) = x]', 'flat')
     PlotData(axs[1], sum_spectra, None, 'Alkaid processed data')
+    axs[0].legend()
+    axs[1].legend()
     plt.tight_layout()
     plt.savefig(savefold+'/Alkaid.png', dpi = 600)
 
@@ -256,7 +263,7 @@ if __name__ == '__main__':
 
     wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Capella, α Aurigae [m(V) = 0.08]', save = False, path = savefold, name = "Capella_spectrum_lines.png")
 
@@ -266,11 +273,14 @@ if __name__ == '__main__':
     PlotData(axs[0], dark_av, 'Capella', 'dark')
     PlotData(axs[0], flat_av, 'Capella, α Aurigae [m(V) = 0.08]', 'flat')
     PlotData(axs[1], sum_spectra, None, 'Capella processed data')
+    axs[0].legend()
+    axs[1].legend()
     plt.tight_layout()
     plt.savefig(f'/media/astronomer/Transcend/PhD/oceanview/Spectra_stars/Capella.png', dpi = 600)
 
     fig, axs = plt.subplots(1, 1, figsize=(12, 8))
     PlotData(axs, sum_spectra, 'Capella, α Aurigae [m(V) = 0.08]', 'Capella processed data')
+    axs.legend()
     plt.savefig(f'/media/astronomer/Transcend/PhD/oceanview/Spectra_stars/Capella_spectrum.png', dpi = 600)
     plt.show()
     '''
@@ -303,7 +313,7 @@ if __name__ == '__main__':
 
     #wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    #spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    #spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     #DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'HR6212, ζ Herculis [m(V) = 2.81]', save = True, path = savefold, name = "HR6212_spectrum_lines.png")
 
@@ -360,7 +370,7 @@ if __name__ == '__main__':
 
     #wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
     ## spec_norm = BlackBodyFit(4200, wavelength_truncated, intensity_truncated, True)
-    #spec_norm = FitContinuum(16, wavelength_truncated, intensity_truncated, image = True)
+    #spec_norm, fig_continuum = FitContinuum(16, wavelength_truncated, intensity_truncated, image = True)
 
     #DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Arcturus, α Boötis [m(V) = -0.05]', save = False, path = savefold, name = "Arcturus_spectrum_lines.png")
     # #
@@ -408,7 +418,7 @@ if __name__ == '__main__':
 
     #wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    #spec_norm = FitContinuum(12, wavelength_truncated, intensity_truncated, image = True)
+    #spec_norm, fig_continuum = FitContinuum(12, wavelength_truncated, intensity_truncated, image = True)
 
     #DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Deneb, α Cygni [m(V) = 1.25]', save = True, path = savefold, name = "Deneb_spectrum_lines.png")
     ##
@@ -455,7 +465,7 @@ if __name__ == '__main__':
 
     #wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    #spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    #spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     #DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Rasalhague, α Ophiuchi [m(V) = 2.07]', save = True, path = savefold, name = "Rasalhague_spectrum_lines.png")
 
@@ -502,7 +512,7 @@ if __name__ == '__main__':
 
     #wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
 
-    #spec_norm = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
+    #spec_norm, fig_continuum = FitContinuum(15, wavelength_truncated, intensity_truncated, image = True)
 
     #DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'Alkaid, η Ursae Majoris [m(V) = 1.86]', save = True, path = savefold, name = "Alkaid_spectrum_lines.png")
 
@@ -559,7 +569,7 @@ if __name__ == '__main__':
     #
     # wavelength_truncated, intensity_truncated = DefSpectrumForLines(sum_spectra, 360, 1100)
     #
-    # spec_norm = FitContinuum(20, wavelength_truncated, intensity_truncated, image = True)
+    # spec_norm, fig_continuum = FitContinuum(20, wavelength_truncated, intensity_truncated, image = True)
     #
     # DetectAndPlotLines(spec_norm, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = 'δ Sagittae [m(V) = 4.21 (3.82)]', save = True, path = savefold, name = "DeltaSge_spectrum_lines.png")
     ##
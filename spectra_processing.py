@@ -10,32 +10,54 @@ import matplotlib as mpl
 import numpy as np
 import glob
 import os
+import functools
+import warnings
 
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy.polynomial import chebyshev
+from scipy.fft import dct
 from scipy.interpolate import CubicSpline
-from astropy.modeling.fitting import LevMarLSQFitter, LinearLSQFitter, SimplexLSQFitter
+from astropy.modeling.fitting import SimplexLSQFitter
 from astropy.modeling import models
 from astropy import units as u
 import lineid_plot
 
-def LoadData(filename, skiprows = 14):
+# Spectra are exchanged as ('wavelength', 'intensity') DataFrames, but the
+# processing itself works on the plain float32 column arrays
+def _SpectrumArrays(spectrum):
+    return (spectrum['wavelength'].to_numpy(dtype=np.float32, copy=False),
+            spectrum['intensity'].to_numpy(dtype=np.float32, copy=False))
 
-    df = pd.read_csv(filename, skiprows = skiprows, sep = '\t', header = None)
-    #print(df)
+def _SpectrumFrame(wavelength, intensity):
+    # The wavelength array usually comes from an input frame, copy it so the result
+    # is independent; intensity is always freshly computed and is wrapped as is
+    return pd.DataFrame({'wavelength': np.array(wavelength), 'intensity': intensity}, copy = False)
 
-    df.columns = ['wavelength', 'intensity']
-
-    # Convert all data to strings first, then replace ',' with '.'
-    df['wavelength'] = df['wavelength'].astype(str).str.replace(',', '.')
-
-    # Remove commas and convert to numeric values for each relevant column
-    df['wavelength'] = pd.to_numeric(df['wavelength'],downcast='float')
-
-    # Convert all data to strings first, then replace ',' with '.'
-    df['intensity'] = df['intensity'].astype(str).str.replace(',', '.')
-
-    # Convert the column back to numeric, coercing any invalid values to NaN
-    df['intensity'] = pd.to_numeric(df['intensity'],  downcast='float')
+def LoadData(filename, skiprows = 14):
 
+    # usecols keeps a trailing tab from turning the first column into the index
+    read_options = dict(skiprows = skiprows, sep = '\t', header = None, usecols = [0, 1], names = ['wavelength', 'intensity'],
+                        engine = 'c')
+
+    def is_numeric(df):
+        return all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes)
+
+    # OceanView exports use ',' as decimal separator, let the C parser handle it directly
+    df = pd.read_csv(filename, decimal = ',', **read_options)
+    if not is_numeric(df):
+        # Files written with '.' as decimal separator (e.g. reference standards)
+        df_point = pd.read_csv(filename, decimal = '.', **read_options)
+        if is_numeric(df_point):
+            df = df_point
+        else:
+            # Neither separator parses cleanly (e.g. a stray footer line), convert the
+            # strings so the error names the offending value and its position
+            for column in df.columns:
+                df[column] = pd.to_numeric(df[column].astype(str).str.replace(',', '.'))
+
+    df = df.astype(np.float32)
+    #print(df)
 
     return df
 
@@ -43,15 +65,13 @@ def LoadData(filename, skiprows = 14):
 def LoadAllSpectra(path, common_part):
     # Use glob to find all files matching the pattern
     pattern = path + common_part + '*.txt'
-    files = glob.glob(pattern)
-
-    # Load each file into a DataFrame and store in a list
-    spectra = []
+    files = sorted(glob.glob(pattern))
     for filename in files:
         print(filename)
-        df = LoadData(filename)
 
-        spectra.append(df)
+    # Load the files concurrently, the C parser releases the GIL while reading
+    with ThreadPoolExecutor(max_workers = max(1, min(8, len(files)))) as executor:
+        spectra = list(executor.map(LoadData, files))
 
     return spectra
 
@@ -68,7 +88,7 @@ def LoadAttenuation(path, filename):
     df = df.dropna()
     df.columns = ['wavelength', 'intensity']
     # Remove commas and convert to numeric values for each relevant column
-    df['wavelength'] = pd.to_numeric(df['wavelength'])
+    df['wavelength'] = pd.to_numeric(df['wavelength'], downcast='float')
     # print(df['wavelength'])
     df['intensity'] = pd.to_numeric(df['intensity'], downcast='float')
     # print(df['intensity'])
@@ -81,37 +101,34 @@ def LoadAttenuation(path, filename):
 def CorrectAttenuation(spectra, attenuation):
 
 
-    attenuation_wvl = attenuation.loc[:, 'wavelength'].values
-    attenuation_coef = attenuation.loc[:, 'intensity'].values
+    attenuation_wvl, attenuation_coef = _SpectrumArrays(attenuation)
     # Convert attenuation to transmission efficiency
     transmission = np.power(10, -(attenuation_coef*1e-3) / 10)
+    transmission_interpolate = CubicSpline(attenuation_wvl, transmission)
+    minwavelength = np.min(attenuation_wvl)
 
     corrected_spectra = []
     for data in spectra:
 
-        corrected_df = data.copy()
-        wavelength = data.loc[:, 'wavelength'].values
-        intensity = data.loc[:, 'intensity'].values
-        minwavelength = np.min(attenuation_wvl)
+        wavelength, intensity = _SpectrumArrays(data)
         maxwavelength = np.max(wavelength)
         # print(minwavelength)
 
         mask = (wavelength >= minwavelength) & (wavelength <= maxwavelength)
         wavelength_truncated = wavelength[mask]
-        intensity_truncated = intensity[mask]
         # print(intensity_truncated.shape)
 
-        transmission_interpolate = CubicSpline(attenuation_wvl, transmission)
         transmission_corsize = transmission_interpolate(wavelength_truncated)
 
         # print(intensity)
-        corrected_df.loc[mask, 'intensity'] = intensity_truncated / transmission_corsize
-        corrected_spectra.append(corrected_df)
+        corrected_intensity = intensity.copy()
+        corrected_intensity[mask] /= transmission_corsize
+        corrected_spectra.append(_SpectrumFrame(wavelength, corrected_intensity))
 
 
         # Plot original and corrected spectra
         # fig, ax = plt.subplots(figsize=(10, 8))
-        # ax.plot(corrected_df['wavelength'], corrected_df['intensity'], label='Corrected Spectra', color='green')
+        # ax.plot(wavelength, corrected_intensity, label='Corrected Spectra', color='green')
         # ax.plot(wavelength, intensity, label='Original Spectra', color='red')
         # ax.set_xlabel('Wavelength')
         # ax.set_ylabel('Intensity')
@@ -194,6 +211,17 @@ def CalcSNRData(sum_data, sigma_dark, sigma_background,subtract_background = Fal
 
     return snr
 
+def _SameWavelengthGrid(spectra):
+    # True when every spectrum is sampled on exactly the same (sorted) wavelength grid
+    wavelength, _ = _SpectrumArrays(spectra[0])
+    if np.any(np.diff(wavelength) <= 0):
+        return False
+    for s in spectra[1:]:
+        other, _ = _SpectrumArrays(s)
+        if not np.array_equal(other, wavelength):
+            return False
+    return True
+
 def AverageSpectra(spectra):
     '''
     Please have your spectra in the following form:
@@ -201,8 +229,24 @@ def AverageSpectra(spectra):
                 spectrum2]
     '''
 
-    combined_spectra = pd.concat(spectra)
-    average_spectra = combined_spectra.groupby('wavelength', as_index=False)['intensity'].mean()
+    # All spectra from the same spectrometer share one wavelength grid, so
+    # average the stacked intensities instead of grouping by wavelength
+    if _SameWavelengthGrid(spectra):
+        wavelength, _ = _SpectrumArrays(spectra[0])
+        stack = np.stack([_SpectrumArrays(s)[1] for s in spectra])
+        # nanmean skips NaN pixels like groupby().mean(), all-NaN pixels stay NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            average_intensity = np.nanmean(stack, axis=0)
+        return _SpectrumFrame(wavelength, average_intensity)
+
+    # Different grids: group on categorical wavelength codes, which takes
+    # pandas' integer groupby path instead of hashing float keys
+    combined_spectra = pd.concat(spectra, ignore_index = True)
+    wavelength = pd.Categorical(combined_spectra['wavelength'])
+    average_intensity = combined_spectra['intensity'].groupby(wavelength, observed = True, sort = True).mean()
+    average_spectra = _SpectrumFrame(average_intensity.index.to_numpy(dtype=np.float32),
+                                     average_intensity.to_numpy(dtype=np.float32))
 
     return average_spectra
 
@@ -220,18 +264,40 @@ def ProcessDataEach(rawdata, background, dark, flat, subtract_background = False
     #if any(len(data) != background_length or len(data) != dark_length for data in rawdata):
         #raise ValueError("Input data frames must have the same length.")
 
-    processed_data = []
+    if not rawdata:
+        return []
+
+    # Subtract background and dark from each raw data spectrum, combined into
+    # a single correction so each spectrum is only traversed once
+    corrections = []
+    if subtract_background:
+        corrections.append(_SpectrumArrays(background)[1])
+    if subtract_dark:
+        corrections.append(_SpectrumArrays(dark)[1])
+    correction = np.sum(corrections, axis=0, dtype=np.float32) if corrections else None
 
-    # Subtract background and dark from each raw data spectrum
-    for data in rawdata:
-        processed_df = data.copy()
-        if subtract_background:
-            processed_df['intensity'] -= background['intensity'].values
-        if subtract_dark:
-            processed_df['intensity'] -= dark['intensity'].values
+    if divide_flat:
+        flat_intensity = _SpectrumArrays(flat)[1]
+        flat_norm = flat_intensity/np.max(flat_intensity)
+
+    # Corrections are applied in place, callers only pass freshly allocated arrays
+    def correct(intensity):
+        if correction is not None:
+            np.subtract(intensity, correction, out=intensity)
         if divide_flat:
-            processed_df['intensity'] /= flat['intensity'].values/np.max(flat['intensity'])
-        processed_data.append(processed_df)
+            np.divide(intensity, flat_norm, out=intensity)
+        return intensity
+
+    if len({len(data) for data in rawdata}) == 1:
+        # Same length: stack all raw spectra so the corrections are applied in one broadcast
+        intensities = correct(np.stack([_SpectrumArrays(data)[1] for data in rawdata]))
+    else:
+        # Spectra of different lengths cannot be stacked, correct them one by one
+        intensities = [correct(_SpectrumArrays(data)[1].copy()) for data in rawdata]
+
+    processed_data = []
+    for data, intensity in zip(rawdata, intensities):
+        processed_data.append(_SpectrumFrame(_SpectrumArrays(data)[0], intensity))
 
     return processed_data
 
@@ -239,10 +305,8 @@ def Build_Instrument_Response(data, reference, plot=False):
     #required_columns = ['wavelength', 'intensity']
 
     #get wavelengths of our data and of our reference
-    wavelength = data['wavelength'].values
-    intensity  =data['intensity'].values
-    wavelength_stand = reference['wavelength'].values
-    intensity_stand = reference['intensity'].values
+    wavelength, intensity = _SpectrumArrays(data)
+    wavelength_stand, intensity_stand = _SpectrumArrays(reference)
 
     #Mininum and maximum wavelength of Ocean View
     minwavelength = 400.0
@@ -268,41 +332,35 @@ def Build_Instrument_Response(data, reference, plot=False):
     interpolate = CubicSpline(wavelength_truncated, intensity_truncated)
 
     #Get the values of the reference data at our ocean wavelenghts
-    intensity_standard = interpolate(wavelength)
+    intensity_standard = interpolate(wavelength).astype(np.float32)
 
     if plot==True:
         fig1, axs1 = plt.subplots(2, 1, figsize=(12, 8))
         PlotData(axs1[0], reference, 'Reference Data Raw', 'Raw data')
+        axs1[0].legend()
         axs1[1].plot(wavelength_truncated,intensity_truncated)
         plt.show()
 
-    #Save this data on a pandas dataframe
-    d = {'wavelength': wavelength, 'intensity': intensity}
-    norma_data_df = pd.DataFrame(data=d)
-    # print(norma_data_df['wavelength'])
-
-    d1 = {'wavelength': wavelength, 'intensity': intensity_standard}
-    norma_ref_df = pd.DataFrame(data=d1)
-
     # Calculate scale factor and normalize observed counts
     ourdata_sum = np.sum(intensity)
     standard_sum = np.sum(intensity_standard)
     scale_factor = standard_sum / ourdata_sum
 
+    intensity_normalized = intensity*scale_factor
 
-    norma_data_df['intensity'] *= scale_factor
-
-
-    ins_response = norma_data_df.copy()
-    
-    ins_response['intensity'] = norma_data_df['intensity'].values/norma_ref_df['intensity'].values
-    
+    ins_response = _SpectrumFrame(wavelength, intensity_normalized/intensity_standard)
 
     if plot==True:
+        #Save this data on a pandas dataframe
+        norma_data_df = _SpectrumFrame(wavelength, intensity_normalized)
+        norma_ref_df = _SpectrumFrame(wavelength, intensity_standard)
+
         fig, axs = plt.subplots(2, 1, figsize=(12, 8))
         PlotData(axs[0], norma_ref_df, 'Reference Data Normalized', 'Reference Spectrophotometric Standard')
         PlotData(axs[0], norma_data_df, 'Data Normalized', 'Ocean Data Spectrophotometric Standard')
         PlotData(axs[1], ins_response, 'Data/Ref', 'Instrument Response Function')
+        axs[0].legend()
+        axs[1].legend()
         plt.show()
 
 
@@ -337,15 +395,35 @@ def AddSpectra(spectra):
                 spectrum2]
     '''
 
-    combined_spectra = pd.concat(spectra)
-    summed_spectra = combined_spectra.groupby('wavelength', as_index=False)['intensity'].sum()
+    if _SameWavelengthGrid(spectra):
+        wavelength, _ = _SpectrumArrays(spectra[0])
+        stack = np.stack([_SpectrumArrays(s)[1] for s in spectra])
+        # nansum skips NaN pixels like groupby().sum()
+        return _SpectrumFrame(wavelength, np.nansum(stack, axis=0))
+
+    # Different grids: sort all samples once by wavelength and sum each run of equal wavelengths
+    wavelength = np.concatenate([_SpectrumArrays(s)[0] for s in spectra])
+    intensity = np.concatenate([_SpectrumArrays(s)[1] for s in spectra])
+
+    # Like groupby: rows without a wavelength are dropped and NaN intensities count as 0
+    valid = ~np.isnan(wavelength)
+    wavelength = wavelength[valid]
+    intensity = np.where(np.isnan(intensity[valid]), 0, intensity[valid])
+
+    order = np.argsort(wavelength, kind = 'stable')
+    wavelength = wavelength[order]
+    intensity = intensity[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(wavelength)) + 1))
+
+    summed_spectra = _SpectrumFrame(wavelength[starts], np.add.reduceat(intensity, starts))
     #print(summed_spectra)
     return summed_spectra
 
 def PlotData(ax, data, name, labelname):
+    # The legend is not rebuilt here, call ax.legend() once after all spectra are plotted
     #print(data)
-    wavelength = data.loc[:, 'wavelength']
-    intensity = data.loc[:, 'intensity']
+    wavelength = data['wavelength'].to_numpy()
+    intensity = data['intensity'].to_numpy()
     ax.plot(wavelength, intensity, label = labelname)
     ax.minorticks_on()
     ax.xaxis.set_minor_locator(plt.MultipleLocator(10))
@@ -353,34 +431,83 @@ def PlotData(ax, data, name, labelname):
     ax.set_xlabel(f'Wavelength, nm')
     ax.set_ylabel(f'Intensity, counts')
     ax.set_title(name)
-    ax.legend()
 
     return
 
 def DefSpectrumForLines(spectr, minwavelength, maxwavelength):
 
-    wavelength = spectr.loc[:, 'wavelength'].values
-    intensity = spectr.loc[:, 'intensity'].values
+    wavelength, intensity = _SpectrumArrays(spectr)
 
-    mask = (wavelength >= minwavelength) & (wavelength <= maxwavelength)
-    wavelength_truncated = wavelength[mask]
-    intensity_truncated = intensity[mask]
+    # Wavelengths are sorted, so the range is a contiguous slice
+    lo = np.searchsorted(wavelength, minwavelength, side = 'left')
+    hi = np.searchsorted(wavelength, maxwavelength, side = 'right')
+    wavelength_truncated = wavelength[lo:hi]
+    intensity_truncated = intensity[lo:hi]
     # spectrum = Spectrum1D(flux=intensity_truncated*u.adu, spectral_axis=wavelength_truncated*u.nm)
 
 
     return wavelength_truncated, intensity_truncated
 
-def FitContinuum(degree, wavelength, intensity, image = False):
+def _ChebyshevWindow(wavelength):
+    # Map the wavelengths onto the Chebyshev window [-1, 1]
+    wavelength = np.asarray(wavelength, dtype = np.float64)
+    return 2*(wavelength - wavelength.min())/(wavelength.max() - wavelength.min()) - 1
+
+@functools.lru_cache(maxsize = 8)
+def _CachedChebyshevBasis(wavelength_bytes, dtype, degree):
+    x = _ChebyshevWindow(np.frombuffer(wavelength_bytes, dtype = dtype))
+
+    # Only the pseudo-inverse of the Vandermonde matrix is kept, the continuum
+    # itself is evaluated with the Clenshaw recurrence
+    pinv = np.linalg.pinv(chebyshev.chebvander(x, degree))
+    x.flags.writeable = False
+    pinv.flags.writeable = False
+
+    return x, pinv
+
+def _ChebyshevBasis(degree, wavelength):
+    # Mapped grid and pseudo-inverse only depend on the grid and degree, so reuse them between fits
+    wavelength = np.ascontiguousarray(wavelength)
+    return _CachedChebyshevBasis(wavelength.tobytes(), wavelength.dtype.str, degree)
+
+def _ChebyshevCoefficientsDCT(degree, wavelength, intensity):
+    # Resample the spectrum at the Chebyshev-Lobatto nodes cos(pi*j/n), the
+    # Chebyshev coefficients are then given by a type-1 DCT of the samples
+
+    # np.interp needs an increasing grid
+    order = np.argsort(wavelength, kind = 'stable')
+    wavelength = np.asarray(wavelength)[order]
+    intensity = np.asarray(intensity)[order]
+
+    n = 1 << int(np.ceil(np.log2(max(4*degree, len(wavelength)))))
+    nodes = np.cos(np.pi*np.arange(n + 1)/n)
+    minwavelength = np.min(wavelength)
+    maxwavelength = np.max(wavelength)
+    samples = np.interp(minwavelength + (nodes + 1)*(maxwavelength - minwavelength)/2, wavelength, intensity)
+
+    coeffs = dct(samples, type = 1)/n
+    coeffs[0] /= 2
+    coeffs[-1] /= 2
 
-    chebyshev_model = models.Chebyshev1D(degree=degree)
-    fitter = LinearLSQFitter()
-    g1_fit = fitter(chebyshev_model, wavelength, intensity)
-    spec_norm = (intensity - g1_fit(wavelength))/np.linalg.norm(intensity - g1_fit(wavelength))
+    return coeffs[:degree + 1]
+
+def FitContinuum(degree, wavelength, intensity, image = False, use_dct = False):
+
+    if use_dct:
+        # Chebyshev interpolation on resampled nodes, O(N log N), useful for high degrees
+        x = _ChebyshevWindow(wavelength)
+        coeffs = _ChebyshevCoefficientsDCT(degree, wavelength, intensity)
+    else:
+        x, pinv = _ChebyshevBasis(degree, wavelength)
+        coeffs = pinv @ intensity
+    continuum = chebyshev.chebval(x, coeffs)
+    residual = intensity - continuum
+    spec_norm = residual/np.linalg.norm(residual)
 
     if image == True:
         fig, ax = plt.subplots(2, 1, figsize=(10, 8))
         ax[0].plot(wavelength, intensity, label='Original Spectrum')
-        ax[0].plot(wavelength, g1_fit(wavelength), label='Fitted Continuum')
+        ax[0].plot(wavelength, continuum, label='Fitted Continuum')
         ax[0].set_title('Continuum Fitting')
         ax[0].legend()
         ax[0].grid(True)
@@ -390,6 +517,26 @@ def FitContinuum(degree, wavelength, intensity, image = False):
         ax[1].set_title('Continuum Normalized Spectrum')
         ax[1].grid(True)
 
+        # Hand the figure back so callers fitting in a loop can plt.close(fig) it
+        return spec_norm, fig
+
+    return spec_norm
+
+def FitContinuumBatch(degree, wavelength, intensity_matrix):
+    '''
+    Please have the spectra, all sampled on the same wavelength grid, as the
+    columns of intensity_matrix:
+    intensity_matrix = np.column_stack([intensity1,
+                                        intensity2])
+    '''
+
+    # One shared solve for every spectrum: all coefficients come from a single matrix product
+    x, pinv = _ChebyshevBasis(degree, wavelength)
+    coeffs = pinv @ intensity_matrix
+    continuum = chebyshev.chebval(x, coeffs).T
+    residual = intensity_matrix - continuum
+    spec_norm = residual/np.linalg.norm(residual, axis=0)
+
     return spec_norm
 
 def BlackBodyFit(temperature, wavelength, intensity, image = False):
@@ -399,12 +546,14 @@ def BlackBodyFit(temperature, wavelength, intensity, image = False):
     intensity_flux = intensity / np.max(intensity)
     fit = fitter(bb, wavelength*u.nm, intensity_flux)
     # plt.plot(wavelength*u.nm, bb(wavelength*u.nm))
-    spec_norm = (intensity_flux - fit(wavelength*u.nm).value)/np.linalg.norm(intensity_flux - fit(wavelength*u.nm).value)
+    continuum = fit(wavelength*u.nm).value
+    residual = intensity_flux - continuum
+    spec_norm = residual/np.linalg.norm(residual)
 
     if image == True:
         fig, ax = plt.subplots(2, 1, figsize=(10, 8))
         ax[0].plot(wavelength, intensity_flux, label='Original Spectrum')
-        ax[0].plot(wavelength, fit(wavelength*u.nm), label='Fitted Continuum')
+        ax[0].plot(wavelength, continuum, label='Fitted Continuum')
         ax[0].set_title('Continuum Fitting')
         ax[0].legend()
         ax[0].grid(True)
@@ -415,54 +564,80 @@ def BlackBodyFit(temperature, wavelength, intensity, image = False):
         ax[1].grid(True)
 
 
+def _DetectLineMask(wavelength, spectra, line_targets, threshold, neighbor_offset):
+    last = len(wavelength) - 1
+
+    # Nearest sample of each target wavelength, found with a single binary search
+    indices = np.clip(np.searchsorted(wavelength, line_targets), 1, last)
+    closer_left = np.abs(line_targets - wavelength[indices - 1]) <= np.abs(wavelength[indices] - line_targets)
+    indices = np.where(closer_left, indices - 1, indices)
+
+    # Line is detected if it is deep enough and a local minimum with respect to its neighbours
+    flux = spectra[indices]
+    return ((- flux >= threshold)
+            & (flux < spectra[np.clip(indices - neighbor_offset, 0, last)])
+            & (flux < spectra[np.clip(indices + neighbor_offset, 0, last)]))
+
 def DetectAndPlotLines(spectra, wavelength_truncated, spectral_lines, telluric_lines, threshold, title = None, save = False, path = None, name = None):
 
-    detected_lines = {}
-    telluric_lines_d = {}
+    # Only lines inside the observed range can be detected
+    minwavelength = wavelength_truncated[0]
+    maxwavelength = wavelength_truncated[-1]
+    spectral_lines = {line_name: line_wavelength for line_name, line_wavelength in spectral_lines.items()
+                      if minwavelength <= line_wavelength <= maxwavelength}
+    telluric_in_range = [line_wavelength for line_wavelength in telluric_lines["TL"]
+                         if minwavelength <= line_wavelength <= maxwavelength]
 
     # Step 4: Check for each line if its depth/strength exceeds the threshold
-    for line_name, line_wavelength in spectral_lines.items():
-        index = np.argmin(np.abs(wavelength_truncated - line_wavelength))
-        flux = spectra[index]
-        depth = - flux
-        if depth >= threshold:
-            if flux < spectra[index - 10] and flux < spectra[index + 10]:
-                detected_lines[line_name] = line_wavelength
-
-    for line_wavelength in telluric_lines["TL"]:
-        index = np.argmin(np.abs(wavelength_truncated - line_wavelength))
-        flux = spectra[index]
-        depth = - flux
-        if depth >= 0.02:
-            if flux < spectra[index - 1] and flux < spectra[index + 1]:
-                telluric_lines_d[line_wavelength] = line_wavelength
-
-    fig, ax = lineid_plot.plot_line_ids(
-        wavelength_truncated,
-        spectra,
-        list(detected_lines.values()) + list(telluric_lines_d.values()),  # Flux values of detected lines
-        list(detected_lines.keys()) + ["TL"]*len(telluric_lines_d),    # Names of detected lines
-        max_iter = 100)
-    fig.set_size_inches(12, 6)
-    num_detected_lines = len(detected_lines)  # Count of detected lines
-    num_telluric_lines = len(telluric_lines_d)  # Count of telluric lines
-
-    for index in range(num_detected_lines+1, num_detected_lines + num_telluric_lines+1):
-        line = ax.lines[index]
-        line.set_color("red")
-        line.set_linestyle("--")
-
-    for text in ax.texts:
-        if text.get_text() == "TL":  # Target labels with "TL"
+    line_names = list(spectral_lines.keys())
+    line_wavelengths = np.fromiter(spectral_lines.values(), dtype = float, count = len(line_names))
+    mask = _DetectLineMask(wavelength_truncated, spectra, line_wavelengths, threshold, 10)
+    detected_lines = {name: spectral_lines[name] for name, detected in zip(line_names, mask) if detected}
+
+    telluric_wavelengths = np.asarray(telluric_in_range, dtype = float)
+    mask = _DetectLineMask(wavelength_truncated, spectra, telluric_wavelengths, 0.02, 1)
+    telluric_lines_d = {line_wavelength: line_wavelength for line_wavelength, detected in zip(telluric_in_range, mask) if detected}
+
+    if detected_lines or telluric_lines_d:
+        fig, ax = lineid_plot.plot_line_ids(
+            wavelength_truncated,
+            spectra,
+            list(detected_lines.values()) + list(telluric_lines_d.values()),  # Flux values of detected lines
+            list(detected_lines.keys()) + ["TL"]*len(telluric_lines_d),    # Names of detected lines
+            max_iter = 100)
+        fig.set_size_inches(12, 6)
+        num_detected_lines = len(detected_lines)  # Count of detected lines
+        num_telluric_lines = len(telluric_lines_d)  # Count of telluric lines
+
+        for index in range(num_detected_lines+1, num_detected_lines + num_telluric_lines+1):
+            line = ax.lines[index]
+            line.set_color("red")
+            line.set_linestyle("--")
+
+        # Split the labels once: telluric labels are hidden, the others are lifted slightly
+        telluric_texts = []
+        line_texts = []
+        for text in ax.texts:
+            (telluric_texts if text.get_text() == "TL" else line_texts).append(text)
+
+        for text in telluric_texts:
             text.set_visible(False)
-        if text.get_text() != "TL":  # Ignore telluric lines
-            text.set_y(text.get_position()[1] + 0.005)
+        label_y = np.array([text.get_position()[1] for text in line_texts]) + 0.005
+        for text, y in zip(line_texts, label_y):
+            text.set_y(y)
+
+        tl = mpl.lines.Line2D([], [], color='r', linestyle = '--')
+        ax.legend([tl], ['Telluric line'])
+        # Raised above the line labels drawn by lineid_plot
+        ax.set_title(title, y = 1.2, fontweight="bold")
+    else:
+        # Nothing to label, skip the lineid_plot layout and plot the spectrum alone
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.plot(wavelength_truncated, spectra)
+        ax.set_title(title, fontweight="bold")
 
     ax.set_xlabel('Wavelength, nm')
     ax.set_ylabel('Normalised flux')
-    tl = mpl.lines.Line2D([], [], color='r', linestyle = '--')
-    ax.legend([tl], ['Telluric line'])
-    ax.set_title(title, y = 1.2, fontweight="bold")
     if save:
         plt.savefig(path+name, dpi = 600)
 